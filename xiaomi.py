@@ -1,13 +1,45 @@
 #!/usr/bin/python3
 import argparse
 import asyncio
+import functools
 import json
 import math
 import re
-import struct
 import sys
+import time
 
-from bleak import BleakClient, BleakScanner, BLEDevice, AdvertisementData
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+    from bleak import BLEDevice, AdvertisementData
+
+try:
+    import orjson
+
+    def _dumps(data) -> str:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+except ImportError:
+    def _dumps(data) -> str:
+        return json.dumps(data, indent=2)
+
+
+def _compute(temperatureC: float, relHumidity: float) -> 'tuple[float, float, float]':
+
+    z1 = (7.45 * temperatureC) / (235 + temperatureC)
+    # ln(e / 6.1) where e = 6.1 * 10^z1 * rH / 100
+    ln_e_over_6_1 = z1*2.3025851 + math.log(relHumidity / 100.0)
+    e = 6.1 * math.exp(ln_e_over_6_1)
+
+    # absolute humidity / g/m3
+    absHumidity = round((216.7 * e) / (273.15 + temperatureC) * 10) / 10.0
+
+    z3 = 0.434292289 * ln_e_over_6_1
+    dewPointC = round((235 * z3) / (7.45 - z3) * 10) / 10.0
+    steamPressure = round(e * 10) / 10.0
+
+    return absHumidity, dewPointC, steamPressure
 
 
 class Measurement():
@@ -17,48 +49,100 @@ class Measurement():
         self.temperatureC: float = temperatureC
         self.relHumidity: float = relHumidity
 
-        z1 = (7.45 * self.temperatureC) / (235 + self.temperatureC)
-        es = 6.1 * math.exp(z1*2.3025851)
-        e = es * self.relHumidity / 100.0
-        z2 = e / 6.1
+        self._str: Optional[str] = None
+        self._dict: Optional[dict] = None
 
-        # absolute humidity / g/m3
-        self.absHumidity: float = round(
-            (216.7 * e) / (273.15 + self.temperatureC) * 10) / 10.0
+    @functools.cached_property
+    def _derived(self) -> 'tuple[float, float, float]':
 
-        z3 = 0.434292289 * math.log(z2)
-        self.dewPointC: float = int((235 * z3) / (7.45 - z3) * 10) / 10.0
-        self.steamPressure: float = int(e * 10) / 10.0
+        return _compute(self.temperatureC, self.relHumidity)
 
-        self.temperatureF: float = self.temperatureC * 9.0/5.0 + 32
-        self.dewPointF: float = self.dewPointC * 9.0/5.0 + 32
+    @functools.cached_property
+    def absHumidity(self) -> float:
 
-    def __str__(self) -> str:
+        return self._derived[0]
 
-        return "\n".join([
-            f"Temperature:    {self.temperatureC:.1f} °C",
-            f"Dew point:      {self.dewPointC:.1f} °C",
-            "",
-            f"Temperature:    {self.temperatureF:.1f} °F",
-            f"Dew point:      {self.dewPointF:.1f} °F",
-            "",
-            f"Rel. humidity:  {self.relHumidity:.1f} %",
-            f"Abs. humidity:  {self.absHumidity:.1f} g/m³",
-            f"Steam pressure: {self.steamPressure:.1f} mbar"
-        ])
+    @functools.cached_property
+    def dewPointC(self) -> float:
 
-    def to_dict(self) -> dict:
+        return self._derived[1]
+
+    @functools.cached_property
+    def steamPressure(self) -> float:
+
+        return self._derived[2]
+
+    @functools.cached_property
+    def temperatureF(self) -> float:
+
+        return self.temperatureC * 9.0/5.0 + 32
+
+    @functools.cached_property
+    def dewPointF(self) -> float:
+
+        return self.dewPointC * 9.0/5.0 + 32
+
+    @classmethod
+    def from_arrays(cls, temperatureC: 'np.ndarray', relHumidity: 'np.ndarray') -> 'dict[str, np.ndarray]':
+
+        import numpy as np
+
+        temperatureC = np.asarray(temperatureC, dtype=float)
+        relHumidity = np.asarray(relHumidity, dtype=float)
+
+        # same formula and scale-and-round (half to even) as _compute
+        z1 = (7.45 * temperatureC) / (235 + temperatureC)
+        ln_e_over_6_1 = z1*2.3025851 + np.log(relHumidity / 100.0)
+        e = 6.1 * np.exp(ln_e_over_6_1)
+
+        absHumidity = np.round((216.7 * e) / (273.15 + temperatureC) * 10) / 10.0
+
+        z3 = 0.434292289 * ln_e_over_6_1
+        dewPointC = np.round((235 * z3) / (7.45 - z3) * 10) / 10.0
+        steamPressure = np.round(e * 10) / 10.0
 
         return {
-            "temperatureC": self.temperatureC,
-            "temperatureF": self.temperatureF,
-            "relHumidity": self.relHumidity,
-            "absHumidity": self.absHumidity,
-            "dewPointC": self.dewPointC,
-            "dewPointF": self.dewPointF,
-            "steamPressure": self.steamPressure
+            "temperatureC": temperatureC,
+            "temperatureF": temperatureC * 9.0/5.0 + 32,
+            "relHumidity": relHumidity,
+            "absHumidity": absHumidity,
+            "dewPointC": dewPointC,
+            "dewPointF": dewPointC * 9.0/5.0 + 32,
+            "steamPressure": steamPressure
         }
 
+    def __str__(self) -> str:
+
+        if self._str is None:
+            self._str = "\n".join([
+                f"Temperature:    {self.temperatureC:.1f} °C",
+                f"Dew point:      {self.dewPointC:.1f} °C",
+                "",
+                f"Temperature:    {self.temperatureF:.1f} °F",
+                f"Dew point:      {self.dewPointF:.1f} °F",
+                "",
+                f"Rel. humidity:  {self.relHumidity:.1f} %",
+                f"Abs. humidity:  {self.absHumidity:.1f} g/m³",
+                f"Steam pressure: {self.steamPressure:.1f} mbar"
+            ])
+
+        return self._str
+
+    def to_dict(self) -> dict:
+
+        if self._dict is None:
+            self._dict = {
+                "temperatureC": self.temperatureC,
+                "temperatureF": self.temperatureF,
+                "relHumidity": self.relHumidity,
+                "absHumidity": self.absHumidity,
+                "dewPointC": self.dewPointC,
+                "dewPointF": self.dewPointF,
+                "steamPressure": self.steamPressure
+            }
+
+        return dict(self._dict)
+
 
 class DeviceInfo():
 
@@ -71,27 +155,36 @@ class DeviceInfo():
         self.hardware: str = hardware
         self.firmware: str = firmware
 
+        self._str: Optional[str] = None
+        self._dict: Optional[dict] = None
+
     def __str__(self) -> str:
 
-        return "\n".join([
-            f"MAC-Address:    {self.macAddress}",
-            f"Devicename:     {self.name}",
-            f"Manufacturer:   {self.manufacturer}",
-            f"Model:          {self.model}",
-            f"Hardware-Rev.:  {self.hardware}",
-            f"Firmware-Rev.:  {self.firmware}"
-        ])
+        if self._str is None:
+            self._str = "\n".join([
+                f"MAC-Address:    {self.macAddress}",
+                f"Devicename:     {self.name}",
+                f"Manufacturer:   {self.manufacturer}",
+                f"Model:          {self.model}",
+                f"Hardware-Rev.:  {self.hardware}",
+                f"Firmware-Rev.:  {self.firmware}"
+            ])
+
+        return self._str
 
     def to_dict(self) -> dict:
 
-        return {
-            "mac": self.macAddress,
-            "name": self.name,
-            "manufacturer": self.manufacturer,
-            "model": self.model,
-            "hardware": self.hardware,
-            "firmware": self.firmware
-        }
+        if self._dict is None:
+            self._dict = {
+                "mac": self.macAddress,
+                "name": self.name,
+                "manufacturer": self.manufacturer,
+                "model": self.model,
+                "hardware": self.hardware,
+                "firmware": self.firmware
+            }
+
+        return dict(self._dict)
 
 
 class XiaomiThermometerHygrometer():
@@ -104,15 +197,94 @@ class XiaomiThermometerHygrometer():
     _CHARACTERISTIC_BATTERY_LEVEL = '00002a19-0000-1000-8000-00805f9b34fb'
     _CHARACTERISTIC_MEASURE = '226cbb55-6476-4566-7562-66734470666d'
 
-    def __init__(self, mac: str) -> None:
+    _MEASURE_RE = re.compile(rb"T=([0-9.]+) H=([0-9.]+)")
+
+    _DEBUGFS_BLUETOOTH = '/sys/kernel/debug/bluetooth'
+
+    def __init__(self, mac: str, min_conn_interval_ms: Optional[float] = None, max_conn_interval_ms: Optional[float] = None, adapter: Optional[str] = None) -> None:
+
+        from bleak import BleakClient
 
-        self._client = BleakClient(mac)
+        self._client = BleakClient(mac, adapter=adapter) if adapter else BleakClient(mac)
         self._mac = mac
+        self._adapter = adapter or "hci0"
+        self._min_conn_interval_ms = min_conn_interval_ms
+        self._max_conn_interval_ms = max_conn_interval_ms
         self._measurement = None
+        self._measurement_ready = asyncio.Event()
+
+    def _writeConnectionInterval(self, settings: 'list[tuple[str, int]]') -> None:
+
+        # kernel rejects min > max, so retry in reverse order if needed
+        for _ in range(2):
+            pending = list()
+            for name, value in settings:
+                try:
+                    with open(f"{self._DEBUGFS_BLUETOOTH}/{self._adapter}/{name}", "w") as f:
+                        f.write(str(value))
+                except OSError as e:
+                    error = e
+                    pending.append((name, value))
+
+            if not pending:
+                return
+
+            settings = list(reversed(pending))
+
+        raise error
+
+    def _applyConnectionInterval(self) -> 'list[tuple[str, int]]':
+
+        # BlueZ applies the preferred connection interval (in units of
+        # 1.25 ms) of the adapter when a connection is established. It is
+        # only writable via debugfs and applies to every connection of the
+        # adapter, so the previous values are returned in order to restore
+        # them once connected.
+        if not sys.platform.startswith("linux"):
+            raise OSError("connection interval is only supported on Linux")
+
+        settings = list()
+        if self._max_conn_interval_ms is not None:
+            settings.append(
+                ("conn_max_interval", round(self._max_conn_interval_ms / 1.25)))
+        if self._min_conn_interval_ms is not None:
+            settings.append(
+                ("conn_min_interval", round(self._min_conn_interval_ms / 1.25)))
+
+        previous = list()
+        for name, _ in settings:
+            with open(f"{self._DEBUGFS_BLUETOOTH}/{self._adapter}/{name}") as f:
+                previous.append((name, int(f.read())))
+
+        try:
+            self._writeConnectionInterval(settings)
+        except OSError:
+            # undo a partially applied setting
+            try:
+                self._writeConnectionInterval(previous)
+            except OSError:
+                pass
+            raise
+
+        return previous
 
     async def connect(self) -> None:
 
-        await self._client.connect()
+        previous = None
+        if self._min_conn_interval_ms is not None or self._max_conn_interval_ms is not None:
+            try:
+                previous = await asyncio.to_thread(self._applyConnectionInterval)
+            except (OSError, ValueError) as e:
+                print(f"Unable to set connection interval: {e}", file=sys.stderr)
+
+        try:
+            await self._client.connect()
+        finally:
+            if previous:
+                try:
+                    await asyncio.to_thread(self._writeConnectionInterval, previous)
+                except OSError as e:
+                    print(f"Unable to restore connection interval: {e}", file=sys.stderr)
 
     async def disconnect(self) -> None:
 
@@ -120,23 +292,28 @@ class XiaomiThermometerHygrometer():
 
     async def requestMeasurement(self) -> Measurement:
 
-        async def notification_handler(c, bytes: bytearray) -> None:
-            response = bytes.decode()
-            m = re.match("T=([0-9\.]+) H=([0-9\.]+)", response)
+        async def notification_handler(c, data: bytearray, _match=self._MEASURE_RE.match, _Measurement=Measurement, _float=float, _ready=self._measurement_ready) -> None:
+            m = _match(data)
             if m:
-                self._measurement = Measurement(temperatureC=float(
-                    m.groups()[0]), relHumidity=float(m.groups()[1]))
+                t, h = m.groups()
+                self._measurement = _Measurement(
+                    temperatureC=_float(t), relHumidity=_float(h))
+                _ready.set()
+
+        self._measurement = None
+        self._measurement_ready.clear()
 
         if not self._client.is_connected:
-            self.connect()
+            await self.connect()
 
         await self._client.start_notify(0x0d, callback=notification_handler)
         await self._client.write_gatt_char(self._CHARACTERISTIC_MEASURE, bytearray([0x01, 0x00]), response=False)
 
-        i = 0
-        while not self._measurement and i < 10:
-            await asyncio.sleep(.1)
-            i += 1
+        try:
+            await asyncio.wait_for(self._measurement_ready.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
         try:
             await self._client.stop_notify(0x0d)
         except:
@@ -147,64 +324,90 @@ class XiaomiThermometerHygrometer():
     async def requestDeviceInfo(self) -> DeviceInfo:
 
         if not self._client.is_connected:
-            self.connect()
-
-        name = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_NAME)
-        manufacturer = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_MANUFACTURER)
-        model = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_MODEL)
-        hardware = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_HARDWARE)
-        firmware = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_FIRMWARE)
+            await self.connect()
+
+        name, manufacturer, model, hardware, firmware = await asyncio.gather(
+            self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_NAME),
+            self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_MANUFACTURER),
+            self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_MODEL),
+            self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_HARDWARE),
+            self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_FIRMWARE))
         return DeviceInfo(self._mac, name.decode(), manufacturer.decode(), model.decode(), hardware.decode(), firmware.decode())
 
     async def requestBatteryLevel(self) -> int:
 
         if not self._client.is_connected:
-            self.connect()
+            await self.connect()
 
         batteryLevel = await self._client.read_gatt_char(XiaomiThermometerHygrometer._CHARACTERISTIC_BATTERY_LEVEL)
-        return struct.unpack('>B', batteryLevel)[0]
-
-
-async def scan():
-
-    found_devices = list()
-
-    def callback(device: BLEDevice, advertising_data: AdvertisementData):
-        if device.address not in found_devices:
-            found_devices.append(device.address)
-            if device.name and device.address.lower().startswith("4c:65:a8:"):
-                print(
-                    f"{device.address}    {device.name}")
-            elif device.name:
-                print(' %i bluetooth devices seen' %
-                      len(found_devices), end='\r', file=sys.stderr)
+        return batteryLevel[0]
+
+
+async def scan(timeout: float = 20, stop_on_first: bool = False):
+
+    from bleak import BleakScanner
+
+    found_devices = set()
+    last_print = 0.0
+    shown = 0
+    found_sensor = asyncio.Event()
+
+    def callback(device: 'BLEDevice', advertising_data: 'AdvertisementData', _add=found_devices.add, _print=print, _monotonic=time.monotonic):
+        nonlocal last_print, shown
+        address = device.address
+        if address in found_devices:
+            return
+
+        _add(address)
+        name = device.name
+        if name and address.lower().startswith("4c:65:a8:"):
+            _print(
+                f"{address}    {name}")
+            if stop_on_first:
+                found_sensor.set()
+        elif name and _monotonic() - last_print > 0.1:
+            last_print = _monotonic()
+            shown = len(found_devices)
+            _print(' %i bluetooth devices seen' %
+                   shown, end='\r', file=sys.stderr)
+
+    async with BleakScanner(callback):
+        try:
+            await asyncio.wait_for(found_sensor.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
-    async with BleakScanner(callback) as scanner:
-        await asyncio.sleep(20)
+    # throttled redraws may have skipped the latest count
+    if shown and shown != len(found_devices):
+        print(' %i bluetooth devices seen' %
+              len(found_devices), end='\r', file=sys.stderr)
 
 
 async def main(args):
 
-    device = XiaomiThermometerHygrometer(args.mac)
+    device = XiaomiThermometerHygrometer(
+        args.mac, min_conn_interval_ms=args.min_interval, max_conn_interval_ms=args.max_interval, adapter=args.adapter)
     data = dict()
-    output = list()
     try:
         await device.connect()
         if args.info:
             deviceInfo = await device.requestDeviceInfo()
             data["info"] = deviceInfo.to_dict()
-            output.append(f"{str(deviceInfo)}\n")
+            if not args.json:
+                sys.stdout.write(f"{deviceInfo}\n\n")
 
         if args.battery:
             batteryLevel = await device.requestBatteryLevel()
             data["battery"] = batteryLevel
-            output.append(f"Battery-Level:  {batteryLevel}%\n")
+            if not args.json:
+                sys.stdout.write(f"Battery-Level:  {batteryLevel}%\n\n")
 
         if args.measure:
 
             measurement = await device.requestMeasurement()
             data["measurement"] = measurement.to_dict()
-            output.append(f"{str(measurement)}")
+            if not args.json:
+                sys.stdout.write(f"{measurement}\n")
 
     except Exception as e:
         print(e)
@@ -212,13 +415,26 @@ async def main(args):
         await device.disconnect()
 
     if args.json and data:
-        print(json.dumps(data, indent=2))
-    elif output:
-        print("\n".join(output))
+        sys.stdout.write(f"{_dumps(data)}\n")
+
+    sys.stdout.flush()
+
+
+_PARSER: Optional[argparse.ArgumentParser] = None
 
 
 def arg_parse(args: 'list[str]') -> dict:
 
+    global _PARSER
+
+    if _PARSER is None:
+        _PARSER = _build_parser()
+
+    return _PARSER.parse_args(args)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+
     parser = argparse.ArgumentParser(
         'Shell script in order to request Xiaomi temperature humidity sensor')
     parser.add_argument('mac', type=str)
@@ -232,15 +448,23 @@ def arg_parse(args: 'list[str]') -> dict:
         '-j', '--json', help='print in JSON format', action='store_true')
     parser.add_argument(
         '-s', '--scan', help='scan for devices for 20 seconds', action='store_true')
+    parser.add_argument(
+        '-1', '--first', help='stop scanning when the first sensor is found', action='store_true')
+    parser.add_argument(
+        '--min-interval', help='preferred minimum connection interval in ms (Linux, requires root)', type=float, metavar='MS')
+    parser.add_argument(
+        '--max-interval', help='preferred maximum connection interval in ms (Linux, requires root)', type=float, metavar='MS')
+    parser.add_argument(
+        '--adapter', help='bluetooth adapter, e.g. hci0', type=str)
 
-    return parser.parse_args(args)
+    return parser
 
 
 if __name__ == '__main__':
 
     try:
         if '-s' in sys.argv or '--scan' in sys.argv:
-            asyncio.run(scan())
+            asyncio.run(scan(stop_on_first='-1' in sys.argv or '--first' in sys.argv))
 
         else:
             args = arg_parse(sys.argv[1:])